@@ -0,0 +1,23 @@
+# Multi-worker webhook server:  gunicorn main:app_factory
+# Each worker builds its own DB pool, HTTP session and PTB Application via app_factory().
+import os
+import asyncio
+
+bind = "0.0.0.0:8080"
+# Fixed default: cpu_count() reports host cores inside containers and ignores CPU limits.
+# Total DB connections = workers x DB_POOL_MAX_SIZE, keep it under Postgres' max_connections.
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+worker_class = "aiohttp.GunicornUVLoopWebWorker"
+
+def on_starting(server):
+    """Sets the Telegram webhook once in the master, before workers are forked."""
+    # Real worker count (incl. -w on the command line), so main splits its limits by it
+    os.environ["WEB_CONCURRENCY"] = str(server.cfg.workers)
+    from telegram import Bot
+    import main
+
+    async def register():
+        async with Bot(main.TELEGRAM_TOKEN) as bot:
+            await main.set_webhook(bot)
+
+    asyncio.run(register())
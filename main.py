@@ -2,16 +2,26 @@ import os
 import asyncio
 import logging
 import time
-import json
-import requests
-import psycopg2
-from psycopg2.extras import Json
+import math
+import hmac
+import hashlib
+import functools
+import concurrent.futures
+import aiohttp
+import asyncpg
+import orjson
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from openai import OpenAI
+from telegram.error import BadRequest, RetryAfter
+from openai import OpenAI, AsyncOpenAI
 from dotenv import load_dotenv
 from aiohttp import web
 
+try:
+    import uvloop
+except ImportError:  # not available on Windows
+    uvloop = None
+
 # ============================================================================
 # 1. CONFIGURATION & SETUP
 # ============================================================================
@@ -42,6 +52,11 @@ if BASE_URL and BASE_URL.endswith('/'):
 
 REDIRECT_URI = f"{BASE_URL}/strava_callback"
 
+# Telegram echoes this in X-Telegram-Bot-Api-Secret-Token on every webhook call.
+# Defaults to a value derived from the bot token so all workers agree on it.
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET") or hashlib.sha256((TELEGRAM_TOKEN or "").encode()).hexdigest()
+WEBHOOK_MAX_BODY = 256 * 1024  # bytes; real updates are a few KB
+
 WHISPER_API_URL = os.environ.get("WHISPER_API_URL", "http://localhost:8000/v1")
 WHISPER_MODEL = os.environ.get("WHISPER_MODEL", "medium")
 AGENT_MODEL = os.environ.get("AGENT_MODEL", "meta-llama/llama-3.3-70b-instruct:free")
@@ -49,6 +64,28 @@ AGENT_MODEL = os.environ.get("AGENT_MODEL", "meta-llama/llama-3.3-70b-instruct:f
 # Token Limit for AI Response (Controlled via Coolify)
 TOKEN_AI = int(os.environ.get("TOKEN_AI", 1000))
 
+# Number of processes sharing the limits below. `python main.py` is a single process;
+# gunicorn.conf.py exports its real worker count here before main is imported.
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", 1))
+
+# Concurrent calls per remote service, for the whole deployment (split across workers)
+LLM_CONCURRENCY = int(os.environ.get("LLM_CONCURRENCY", 8))
+STRAVA_CONCURRENCY = int(os.environ.get("STRAVA_CONCURRENCY", 4))
+WHISPER_CONCURRENCY = int(os.environ.get("WHISPER_CONCURRENCY", 4))
+
+# DB pool size per process: total connections = WEB_CONCURRENCY x DB_POOL_MAX_SIZE
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", 2))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", 10))
+
+# Chat history: messages kept in the DB / messages sent to the LLM
+HISTORY_LIMIT = 20
+HISTORY_CONTEXT = 10
+
+# Response Cache (semantic layer is enabled only when EMBEDDING_MODEL is set)
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL")
+LLM_CACHE_TTL = int(os.environ.get("LLM_CACHE_TTL", 3600))
+LLM_CACHE_THRESHOLD = float(os.environ.get("LLM_CACHE_THRESHOLD", 0.92))
+
 # LOCKED MODE MESSAGE (HTML FORMAT)
 LOCKED_MESSAGE = (
     "👋 <b>Hello!</b> I am ActiveBuddy — your Personal AI Sports Coach.\n\n"
@@ -79,109 +116,123 @@ SYSTEM_PROMPT = (
     "\n- **Safety:** Decline to answer requests related to illegal acts."
 )
 
+# Per-request part of the system message (filled with .format in run_agent_cycle)
+SYSTEM_PROMPT_TEMPLATE = SYSTEM_PROMPT + "\n\nSTATUS STRAVA: {status}\nCURRENT USER PROFILE:\n{profile_json}"
+
 # ============================================================================
 # 2. DATABASE (PostgreSQL)
 # ============================================================================
+# Statements use $n placeholders so asyncpg's per-connection statement cache
+# prepares each one once and reuses the plan on every later call.
+SQL_CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS user_data (
+    chat_id VARCHAR(50) PRIMARY KEY,
+    profile JSONB DEFAULT '{}'::jsonb,
+    history JSONB DEFAULT '[]'::jsonb,
+    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+"""
+SQL_ADD_STRAVA_AUTH = "ALTER TABLE user_data ADD COLUMN IF NOT EXISTS strava_auth JSONB DEFAULT '{}'::jsonb;"
+
+SQL_GET_USER_ROW = """
+SELECT COALESCE(profile, '{}'::jsonb), COALESCE(history, '[]'::jsonb), COALESCE(strava_auth, '{}'::jsonb)
+FROM user_data WHERE chat_id = $1
+"""
+SQL_GET_STRAVA_TOKENS = "SELECT strava_auth FROM user_data WHERE chat_id = $1"
+
+SQL_APPEND_HISTORY = """
+INSERT INTO user_data (chat_id, history, last_updated)
+VALUES ($1, $2, CURRENT_TIMESTAMP)
+ON CONFLICT (chat_id) DO UPDATE SET history = (
+    SELECT COALESCE(jsonb_agg(t.msg ORDER BY t.idx), '[]'::jsonb)
+    FROM jsonb_array_elements(COALESCE(user_data.history, '[]'::jsonb) || EXCLUDED.history)
+        WITH ORDINALITY AS t(msg, idx)
+    WHERE t.idx > jsonb_array_length(COALESCE(user_data.history, '[]'::jsonb) || EXCLUDED.history) - $3
+);
+"""
+SQL_MERGE_PROFILE = """
+INSERT INTO user_data (chat_id, profile, last_updated)
+VALUES ($1, $2, CURRENT_TIMESTAMP)
+ON CONFLICT (chat_id) DO UPDATE
+SET profile = COALESCE(user_data.profile, '{}'::jsonb) || EXCLUDED.profile, last_updated = CURRENT_TIMESTAMP;
+"""
+SQL_SAVE_STRAVA_TOKENS = """
+INSERT INTO user_data (chat_id, strava_auth, last_updated)
+VALUES ($1, $2, CURRENT_TIMESTAMP)
+ON CONFLICT (chat_id) DO UPDATE SET strava_auth = EXCLUDED.strava_auth;
+"""
+
 class PostgresDB:
     def __init__(self, db_url):
         self.db_url = db_url
-        self._init_db()
-
-    def _get_conn(self):
-        return psycopg2.connect(self.db_url)
-
-    def _init_db(self):
-        create_table_query = """
-        CREATE TABLE IF NOT EXISTS user_data (
-            chat_id VARCHAR(50) PRIMARY KEY,
-            profile JSONB DEFAULT '{}'::jsonb,
-            history JSONB DEFAULT '[]'::jsonb,
-            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-        """
-        alter_table_query = """
-        ALTER TABLE user_data ADD COLUMN IF NOT EXISTS strava_auth JSONB DEFAULT '{}'::jsonb;
-        """
+        self.pool = None
+
+    async def connect(self):
+        """Creates the connection pool. Called once from on_startup."""
+        self.pool = await asyncpg.create_pool(
+            self.db_url, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE, init=self._init_conn
+        )
+        await self._init_db()
+
+    async def close(self):
+        if self.pool:
+            await self.pool.close()
+            self.pool = None
+
+    @staticmethod
+    async def _init_conn(conn):
+        # JSONB columns come back as dicts/lists and accept them directly
+        await conn.set_type_codec(
+            'jsonb', encoder=lambda v: orjson.dumps(v).decode(), decoder=orjson.loads, schema='pg_catalog'
+        )
+
+    async def _init_db(self):
         try:
-            with self._get_conn() as conn:
-                with conn.cursor() as cur:
-                    cur.execute(create_table_query)
-                    cur.execute(alter_table_query) 
+            async with self.pool.acquire() as conn:
+                await conn.execute(SQL_CREATE_TABLE)
+                await conn.execute(SQL_ADD_STRAVA_AUTH)
         except Exception as e:
             logger.error(f"DB Init Error: {e}")
 
-    def get_history(self, chat_id):
-        query = "SELECT history FROM user_data WHERE chat_id = %s"
-        try:
-            with self._get_conn() as conn:
-                with conn.cursor() as cur:
-                    cur.execute(query, (str(chat_id),))
-                    res = cur.fetchone()
-                    return res[0] if res else []
-        except Exception: return []
-
-    def update_history(self, chat_id, history):
-        query = """
-        INSERT INTO user_data (chat_id, history, last_updated)
-        VALUES (%s, %s, CURRENT_TIMESTAMP)
-        ON CONFLICT (chat_id) DO UPDATE SET history = EXCLUDED.history;
-        """
+    async def get_user_row(self, chat_id):
+        """Returns (profile, history, strava_auth) in a single round-trip."""
         try:
-            with self._get_conn() as conn:
-                with conn.cursor() as cur:
-                    cur.execute(query, (str(chat_id), Json(history)))
-        except Exception as e: logger.error(f"DB History Error: {e}")
+            async with self.pool.acquire() as conn:
+                res = await conn.fetchrow(SQL_GET_USER_ROW, str(chat_id))
+                return tuple(res) if res else ({}, [], {})
+        except Exception: return ({}, [], {})
 
-    def get_profile(self, chat_id):
-        query = "SELECT profile FROM user_data WHERE chat_id = %s"
+    async def append_history(self, chat_id, new_messages):
+        """Appends messages and keeps only the last HISTORY_LIMIT, all server-side."""
         try:
-            with self._get_conn() as conn:
-                with conn.cursor() as cur:
-                    cur.execute(query, (str(chat_id),))
-                    res = cur.fetchone()
-                    return res[0] if res else {}
-        except Exception: return {}
+            async with self.pool.acquire() as conn:
+                await conn.execute(SQL_APPEND_HISTORY, str(chat_id), new_messages, HISTORY_LIMIT)
+        except Exception as e: logger.error(f"DB History Error: {e}")
 
-    def save_profile_data(self, chat_id, new_data_dict):
-        current = self.get_profile(chat_id)
-        current.update(new_data_dict)
-        query = """
-        INSERT INTO user_data (chat_id, profile, last_updated)
-        VALUES (%s, %s, CURRENT_TIMESTAMP)
-        ON CONFLICT (chat_id) DO UPDATE SET profile = EXCLUDED.profile;
-        """
+    async def save_profile_data(self, chat_id, new_data_dict):
+        """Merges new keys into the stored profile atomically (jsonb ||), one round-trip."""
         try:
-            with self._get_conn() as conn:
-                with conn.cursor() as cur:
-                    cur.execute(query, (str(chat_id), Json(current)))
+            async with self.pool.acquire() as conn:
+                await conn.execute(SQL_MERGE_PROFILE, str(chat_id), new_data_dict)
             return True
         except Exception as e:
             logger.error(f"DB Profile Error: {e}")
             return False
 
-    def save_strava_tokens(self, chat_id, tokens):
-        query = """
-        INSERT INTO user_data (chat_id, strava_auth, last_updated)
-        VALUES (%s, %s, CURRENT_TIMESTAMP)
-        ON CONFLICT (chat_id) DO UPDATE SET strava_auth = EXCLUDED.strava_auth;
-        """
+    async def save_strava_tokens(self, chat_id, tokens):
         try:
-            with self._get_conn() as conn:
-                with conn.cursor() as cur:
-                    cur.execute(query, (str(chat_id), Json(tokens)))
+            async with self.pool.acquire() as conn:
+                await conn.execute(SQL_SAVE_STRAVA_TOKENS, str(chat_id), tokens)
             return True
         except Exception as e:
             logger.error(f"DB Strava Save Error: {e}")
             return False
 
-    def get_strava_tokens(self, chat_id):
-        query = "SELECT strava_auth FROM user_data WHERE chat_id = %s"
+    async def get_strava_tokens(self, chat_id):
         try:
-            with self._get_conn() as conn:
-                with conn.cursor() as cur:
-                    cur.execute(query, (str(chat_id),))
-                    res = cur.fetchone()
-                    return res[0] if res else {}
+            async with self.pool.acquire() as conn:
+                res = await conn.fetchval(SQL_GET_STRAVA_TOKENS, str(chat_id))
+                return res if res is not None else {}
         except Exception: return {}
 
 db = PostgresDB(DATABASE_URL)
@@ -190,118 +241,200 @@ db = PostgresDB(DATABASE_URL)
 # 3. TOOLS IMPLEMENTATION
 # ============================================================================
 
-def refresh_strava_token(chat_id, refresh_token):
+# Shared HTTP client (keep-alive + DNS cache), created in on_startup
+http_session: aiohttp.ClientSession | None = None
+
+# Per-service concurrency caps, so bursts queue here instead of hitting rate limits.
+# Semaphores are per process, so each worker gets its share of the global budget.
+def per_worker(total):
+    return max(1, total // WEB_CONCURRENCY)
+
+LLM_SEM = asyncio.Semaphore(per_worker(LLM_CONCURRENCY))
+STRAVA_SEM = asyncio.Semaphore(per_worker(STRAVA_CONCURRENCY))
+WHISPER_SEM = asyncio.Semaphore(per_worker(WHISPER_CONCURRENCY))
+# Whisper's client is blocking: run it on its own pool, not the loop's default executor
+WHISPER_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+    max_workers=per_worker(WHISPER_CONCURRENCY), thread_name_prefix="whisper"
+)
+
+# Tool results starting with these are failures and are never cached
+TOOL_ERROR_PREFIXES = ("ERROR", "Error", "Strava Error", "Weather Error", "STATUS: NOT CONNECTED")
+
+def ttl_cache(seconds):
+    """Memoizes an async tool by its arguments for `seconds` (in-process, per worker)."""
+    def decorator(fn):
+        store = {}  # key -> (expires_at, result)
+
+        def make_key(args):
+            return hashlib.sha256(orjson.dumps(args, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+        @functools.wraps(fn)
+        async def wrapper(*args):
+            key = make_key(args)
+            now = time.time()
+            hit = store.get(key)
+            if hit and hit[0] > now:
+                return hit[1]
+            result = await fn(*args)
+            if not result.startswith(TOOL_ERROR_PREFIXES):
+                for k in [k for k, v in store.items() if v[0] <= now]: del store[k]
+                store[key] = (now + seconds, result)
+            return result
+
+        wrapper.invalidate = lambda *args: store.pop(make_key(args), None)
+        return wrapper
+    return decorator
+
+# chat_id -> (access_token, expires_at), so bursts of Strava calls skip the DB
+_token_cache: dict[str, tuple[str, int]] = {}
+# chat_id -> [lock, number of tasks holding or waiting on it]; removed when unused
+_token_locks: dict[str, list] = {}
+TOKEN_REFRESH_MARGIN = 300  # refresh this many seconds before expiry
+
+async def refresh_strava_token(chat_id, refresh_token):
     try:
-        res = requests.post(
+        async with STRAVA_SEM, http_session.post(
             'https://www.strava.com/oauth/token',
             data={
                 'client_id': STRAVA_CLIENT_ID,
                 'client_secret': STRAVA_CLIENT_SECRET,
                 'refresh_token': refresh_token,
                 'grant_type': 'refresh_token'
-            }, timeout=10
-        )
-        if res.status_code == 200:
-            new_tokens = res.json()
-            db.save_strava_tokens(chat_id, new_tokens)
-            return new_tokens['access_token']
-        else:
-            logger.error(f"Strava Refresh Failed: {res.text}")
+            }
+        ) as res:
+            if res.status == 200:
+                new_tokens = orjson.loads(await res.read())
+                await db.save_strava_tokens(chat_id, new_tokens)
+                return new_tokens
+            else:
+                logger.error(f"Strava Refresh Failed: {await res.text()}")
     except Exception as e:
         logger.error(f"Strava Refresh Exception: {e}")
     return None
 
-def check_strava(chat_id): 
-    logger.info(f"🏃 AGENT: Checking Strava for {chat_id}...")
-    
-    tokens = db.get_strava_tokens(chat_id)
-    if not tokens or 'access_token' not in tokens:
-        return "STATUS: NOT CONNECTED. Tell the user to run /connect_strava"
+async def get_strava_access_token(chat_id):
+    """Returns (access_token, error_message); one refresh at a time per chat."""
+    cached = _token_cache.get(chat_id)
+    if cached and time.time() < cached[1] - TOKEN_REFRESH_MARGIN:
+        return cached[0], None
+
+    entry = _token_locks.get(chat_id)
+    if entry is None:
+        entry = _token_locks[chat_id] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            return await _load_strava_token(chat_id)
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del _token_locks[chat_id]
 
-    access_token = tokens['access_token']
-    expires_at = tokens.get('expires_at', 0)
-    refresh_token_val = tokens.get('refresh_token')
+async def _load_strava_token(chat_id):
+    # Another task may have refreshed while we waited for the lock
+    cached = _token_cache.get(chat_id)
+    if cached and time.time() < cached[1] - TOKEN_REFRESH_MARGIN:
+        return cached[0], None
+
+    tokens = await db.get_strava_tokens(chat_id)
+    if not tokens or 'access_token' not in tokens:
+        return None, "STATUS: NOT CONNECTED. Tell the user to run /connect_strava"
 
-    if time.time() > (expires_at - 60):
+    if time.time() > (tokens.get('expires_at', 0) - TOKEN_REFRESH_MARGIN):
         logger.info(f"Token expired for {chat_id}, refreshing...")
-        access_token = refresh_strava_token(chat_id, refresh_token_val)
-        if not access_token:
-            return "ERROR: Token expired and refresh failed. Please reconnect Strava."
+        tokens = await refresh_strava_token(chat_id, tokens.get('refresh_token'))
+        if not tokens:
+            return None, "ERROR: Token expired and refresh failed. Please reconnect Strava."
+
+    _token_cache[chat_id] = (tokens['access_token'], tokens.get('expires_at', 0))
+    return tokens['access_token'], None
+
+def format_activity(act):
+    _get = act.get
+    m = _get('moving_time', 0) // 60
+    h, m = divmod(m, 60)
+    time_str = f"{h}h {m}m" if h > 0 else f"{m}m"
+    distance_meters = _get('distance', 0)
+    stats = f"{round(distance_meters / 1000, 2)}km in {time_str}" if distance_meters > 0 else f"Duration: {time_str}"
+    return f"Date: {_get('start_date_local', '')[:16].replace('T', ' ')}, Type: {_get('type', 'Activity')}, {stats}, HR: {_get('average_heartrate', 'N/A')}"
+
+@ttl_cache(5 * 60)
+async def check_strava(chat_id): 
+    logger.info(f"🏃 AGENT: Checking Strava for {chat_id}...")
+    
+    access_token, error = await get_strava_access_token(chat_id)
+    if error:
+        return error
 
     try:
-        after_ts = int(time.time()) - (7 * 86400)
-        res = requests.get(
+        # Newest-first is Strava's default order without `after`, so the first page
+        # of 10 is all we need; the 7-day window is applied locally.
+        async with STRAVA_SEM, http_session.get(
             'https://www.strava.com/api/v3/athlete/activities',
             headers={'Authorization': f'Bearer {access_token}'},
-            params={'after': after_ts, 'per_page': 40}, 
-            timeout=10
-        )
-        
-        if res.status_code == 401:
-            return "ERROR: Strava Unauthorized. Try /connect_strava again."
+            params={'per_page': 10}
+        ) as res:
+            if res.status == 401:
+                _token_cache.pop(chat_id, None)
+                return "ERROR: Strava Unauthorized. Try /connect_strava again."
+            if res.status == 429:
+                return "Strava Error: Rate limit reached, try again in a few minutes."
 
-        activities = res.json()
-        
-        if not activities: return "Strava: No activities found in the last 7 days."
+            activities = orjson.loads(await res.read())
 
         if isinstance(activities, dict) and 'message' in activities:
              return f"Strava Error: {activities['message']}"
 
-        activities.sort(key=lambda x: x['start_date'], reverse=True)
-        recent_activities = activities[:10] 
+        cutoff = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() - 7 * 86400))
+        recent_activities = [act for act in activities if act.get('start_date', '') >= cutoff]
 
-        summary = []
-        for act in recent_activities:
-            type_act = act.get('type', 'Activity')
-            date = act.get('start_date_local', '')[:16].replace('T', ' ') 
-            hr = act.get('average_heartrate', 'N/A')
-            
-            distance_meters = act.get('distance', 0)
-            moving_time_seconds = act.get('moving_time', 0)
-            
-            m, s = divmod(moving_time_seconds, 60)
-            h, m = divmod(m, 60)
-            time_str = f"{h}h {m}m" if h > 0 else f"{m}m"
+        if not recent_activities: return "Strava: No activities found in the last 7 days."
 
-            if distance_meters > 0:
-                dist_km = round(distance_meters / 1000, 2)
-                stats = f"{dist_km}km in {time_str}"
-            else:
-                stats = f"Duration: {time_str}"
-
-            summary.append(f"Date: {date}, Type: {type_act}, {stats}, HR: {hr}")
-        
-        return "Recent Activities (Newest First):\n" + "\n".join(summary)
+        return "Recent Activities (Newest First):\n" + "\n".join(map(format_activity, recent_activities))
     except Exception as e:
         return f"Strava Error: {str(e)}"
 
-def check_weather(city_english):
+# WMO weather interpretation codes (as returned by Open-Meteo)
+WMO_DESC = {
+    0: "Clear", 1: "Mainly Clear", 2: "Partly Cloudy", 3: "Overcast",
+    45: "Fog", 48: "Fog",
+    51: "Drizzle", 53: "Drizzle", 55: "Drizzle", 56: "Freezing Drizzle", 57: "Freezing Drizzle",
+    61: "Rain", 63: "Rain", 65: "Heavy Rain", 66: "Freezing Rain", 67: "Freezing Rain",
+    71: "Snow", 73: "Snow", 75: "Heavy Snow", 77: "Snow Grains",
+    80: "Rain Showers", 81: "Rain Showers", 82: "Heavy Rain Showers",
+    85: "Snow Showers", 86: "Snow Showers",
+    95: "Thunderstorm", 96: "Thunderstorm with Hail", 99: "Thunderstorm with Hail",
+}
+
+@ttl_cache(10 * 60)
+async def check_weather(city_english):
     logger.info(f"🌦 AGENT: Checking weather for {city_english}...")
     try:
-        geo = requests.get("https://geocoding-api.open-meteo.com/v1/search", 
-            params={"name": city_english, "count": 1, "language": "en", "format": "json"}).json()
+        async with http_session.get("https://geocoding-api.open-meteo.com/v1/search", 
+            params={"name": city_english, "count": 1, "language": "en", "format": "json"}) as r:
+            geo = orjson.loads(await r.read())
         if not geo.get("results"): return f"Error: City '{city_english}' not found."
         
         loc = geo["results"][0]
-        w = requests.get("https://api.open-meteo.com/v1/forecast",
+        async with http_session.get("https://api.open-meteo.com/v1/forecast",
             params={"latitude": loc["latitude"], "longitude": loc["longitude"],
-                    "current": "temperature_2m,weather_code,apparent_temperature"}).json()
+                    "current": "temperature_2m,weather_code,apparent_temperature"}) as r:
+            w = orjson.loads(await r.read())
         
         curr = w["current"]
-        code = curr["weather_code"]
-        desc = "Cloudy"
-        if code == 0: desc = "Clear"
-        elif code in [51, 53, 55, 61, 63]: desc = "Rain"
-        elif code in [71, 73, 75]: desc = "Snow"
+        desc = WMO_DESC.get(curr["weather_code"], "Cloudy")
         
         return f"Weather in {loc['name']}: {desc}, Temp: {curr['temperature_2m']}C, Feels: {curr['apparent_temperature']}C"
     except Exception as e: return f"Weather Error: {str(e)}"
 
-def save_profile_info(chat_id, info_json):
+async def save_profile_info(chat_id, info_json):
     logger.info(f"💾 AGENT: Saving profile for {chat_id}: {info_json}")
     try:
-        data = json.loads(info_json)
-        db.save_profile_data(chat_id, data)
+        data = orjson.loads(info_json)
+        if not isinstance(data, dict):
+            raise ValueError("info_json must be a JSON object")
+        if not await db.save_profile_data(chat_id, data):
+            return "Error saving profile: database write failed."
         return "Profile information saved successfully."
     except Exception as e:
         return f"Error saving profile: {e}"
@@ -309,10 +442,11 @@ def save_profile_info(chat_id, info_json):
 # ============================================================================
 # 4. AGENT LOGIC
 # ============================================================================
-client_llm = OpenAI(
+client_llm = AsyncOpenAI(
     base_url="https://openrouter.ai/api/v1",
     api_key=OPENROUTER_API_KEY,
-    default_headers={"HTTP-Referer": "https://bot.local", "X-Title": "AgentCoach"}
+    default_headers={"HTTP-Referer": "https://bot.local", "X-Title": "AgentCoach"},
+    max_retries=4  # SDK retries 429/5xx with exponential backoff (honours Retry-After)
 )
 client_whisper = OpenAI(base_url=WHISPER_API_URL, api_key="sk-dummy")
 
@@ -355,76 +489,189 @@ TOOLS_SCHEMA = [
     }
 ]
 
-def run_agent_cycle(chat_id, user_text):
+class LLMCache:
+    """In-process cache of final assistant replies.
+
+    Exact layer: hash of model + system prompt (includes the profile) + last 3 messages.
+    Semantic layer: per-chat embeddings of the user text only, hit on cosine > threshold.
+    Prompt/profile are pinned by profile_version and the conversation by the previous
+    assistant turn, so "yes" to two different questions never matches. Short messages
+    skip the semantic layer (too little signal to compare).
+    Replies that needed tool calls are never stored (they depend on live data / side effects).
+    """
+    MAX_ENTRIES_PER_CHAT = 50
+    SEMANTIC_MIN_CHARS = 20
+
+    def __init__(self, ttl, threshold, embedding_model=None):
+        self.ttl = ttl
+        self.threshold = threshold
+        self.embedding_model = embedding_model
+        self._exact = {}     # key -> (expires_at, text)
+        self._semantic = {}  # chat_id -> [(expires_at, context_key, embedding, text)]
+
+    @staticmethod
+    def cache_key(model, messages):
+        tail = [{"role": m["role"], "content": m["content"]} for m in messages[-3:]]
+        raw = orjson.dumps([model, messages[0]["content"], tail], option=orjson.OPT_SORT_KEYS)
+        return hashlib.sha256(raw).hexdigest()
+
+    async def _embed(self, text):
+        async with LLM_SEM:
+            res = await client_llm.embeddings.create(model=self.embedding_model, input=text)
+        vec = res.data[0].embedding
+        norm = math.sqrt(sum(x * x for x in vec)) or 1.0
+        return [x / norm for x in vec]
+
+    @staticmethod
+    def context_key(messages, profile_version):
+        """Profile version + previous assistant turn: what the user text is answering."""
+        prev = messages[-2] if len(messages) > 2 and messages[-2]["role"] == "assistant" else None
+        raw = orjson.dumps([profile_version, prev["content"] if prev else ""])
+        return hashlib.sha256(raw).hexdigest()
+
+    def _lookup_semantic(self, chat_id, context_key, embedding, now):
+        entries = [e for e in self._semantic.get(chat_id, []) if e[0] > now]
+        if not entries:
+            self._semantic.pop(chat_id, None)
+            return None
+        self._semantic[chat_id] = entries
+        best_score, best_text = 0.0, None
+        for _, key, vec, text in entries:
+            if key != context_key: continue
+            score = sum(a * b for a, b in zip(vec, embedding))
+            if score > best_score:
+                best_score, best_text = score, text
+        return best_text if best_score > self.threshold else None
+
+    async def get_or_compute(self, chat_id, messages, profile_version, compute):
+        """Returns a cached reply or awaits compute() -> (text, cacheable)."""
+        now = time.time()
+        key = self.cache_key(AGENT_MODEL, messages)
+        hit = self._exact.get(key)
+        if hit and hit[0] > now:
+            logger.info(f"⚡ LLM cache hit (exact) for {chat_id}")
+            return hit[1]
+
+        embedding = None
+        user_text = messages[-1]["content"].strip()
+        context_key = self.context_key(messages, profile_version)
+        if self.embedding_model and len(user_text) >= self.SEMANTIC_MIN_CHARS:
+            try:
+                embedding = await self._embed(user_text)
+                text = self._lookup_semantic(chat_id, context_key, embedding, now)
+                if text is not None:
+                    logger.info(f"⚡ LLM cache hit (semantic) for {chat_id}")
+                    return text
+            except Exception as e:
+                logger.error(f"Embedding Error: {e}")
+                embedding = None
+
+        text, cacheable = await compute()
+        if cacheable and text:
+            expires_at = time.time() + self.ttl
+            self._exact = {k: v for k, v in self._exact.items() if v[0] > now}
+            self._exact[key] = (expires_at, text)
+            # Drop expired semantic entries (and chats left with none) across all chats
+            for cid in list(self._semantic):
+                alive = [e for e in self._semantic[cid] if e[0] > now]
+                if alive: self._semantic[cid] = alive
+                else: del self._semantic[cid]
+            if embedding is not None:
+                entries = self._semantic.setdefault(chat_id, [])
+                entries.append((expires_at, context_key, embedding, text))
+                del entries[:-self.MAX_ENTRIES_PER_CHAT]
+        return text
+
+llm_cache = LLMCache(LLM_CACHE_TTL, LLM_CACHE_THRESHOLD, EMBEDDING_MODEL)
+
+async def run_agent_cycle(chat_id, user_text, user_row=None, on_partial=None):
     chat_id = str(chat_id) 
-    history = db.get_history(chat_id)
-    profile = db.get_profile(chat_id)
-    
-    strava_tokens = db.get_strava_tokens(chat_id)
-    strava_status = "CONNECTED ✅" if strava_tokens else "NOT CONNECTED ❌"
+    if user_row is None:
+        user_row = await db.get_user_row(chat_id)
+    profile, history, strava_tokens = user_row
 
-    system_msg_content = SYSTEM_PROMPT
-    system_msg_content += f"\n\nSTATUS STRAVA: {strava_status}"
-    if profile:
-        system_msg_content += f"\nCURRENT USER PROFILE:\n{json.dumps(profile, ensure_ascii=False)}"
-
-    clean_history = [
-        {"role": m["role"], "content": m["content"]} 
-        for m in history if m["role"] in ["user", "assistant"] and m.get("content")
-    ][-10:]
+    strava_status = "CONNECTED ✅" if strava_tokens else "NOT CONNECTED ❌"
+    profile_json = orjson.dumps(profile).decode()
+    system_msg_content = SYSTEM_PROMPT_TEMPLATE.format(status=strava_status, profile_json=profile_json)
 
-    messages = [{"role": "system", "content": system_msg_content}] + clean_history
+    # History is stored clean and already capped; legacy rows may hold empty assistant turns
+    messages = [{"role": "system", "content": system_msg_content}]
+    messages += [m for m in history[-HISTORY_CONTEXT:] if m.get("content")]
     messages.append({"role": "user", "content": user_text})
-
-    try:
-        response = client_llm.chat.completions.create(
-            model=AGENT_MODEL, 
-            messages=messages, 
-            tools=TOOLS_SCHEMA, 
-            tool_choice="auto",
-            max_tokens=TOKEN_AI  # Set token limit here
-        )
+    profile_version = hashlib.sha256(profile_json.encode()).hexdigest()
+
+    async def dispatch(tool_call):
+        func_name = tool_call.function.name
+        args = orjson.loads(tool_call.function.arguments)
+        tool_result = "Error"
+
+        if func_name == "check_strava":
+            tool_result = await check_strava(chat_id)
+        elif func_name == "check_weather":
+            city = args.get("city_english")
+            if not city: city = profile.get("location") or profile.get("city")
+            if not city: city = "Kyiv"
+            tool_result = await check_weather(city)
+        elif func_name == "save_profile_info":
+            tool_result = await save_profile_info(chat_id, args.get("info_json", "{}"))
+
+        return tool_call.id, tool_result
+
+    async def ask_llm():
+        async with LLM_SEM:
+            response = await client_llm.chat.completions.create(
+                model=AGENT_MODEL, 
+                messages=messages, 
+                tools=TOOLS_SCHEMA, 
+                tool_choice="auto",
+                max_tokens=TOKEN_AI  # Set token limit here
+            )
         msg = response.choices[0].message
         
         if msg.tool_calls:
             logger.info(f"🤖 Agent calls {len(msg.tool_calls)} tools")
             messages.append(msg)
 
+            # Profile writes run first (serially), read-only tools run concurrently
+            writes = [tc for tc in msg.tool_calls if tc.function.name == "save_profile_info"]
+            reads = [tc for tc in msg.tool_calls if tc.function.name != "save_profile_info"]
+            results = dict([await dispatch(tc) for tc in writes])
+            results.update(await asyncio.gather(*map(dispatch, reads)))
+
             for tool_call in msg.tool_calls:
-                func_name = tool_call.function.name
-                args = json.loads(tool_call.function.arguments)
-                tool_result = "Error"
-                
-                if func_name == "check_strava":
-                    tool_result = check_strava(chat_id)
-                elif func_name == "check_weather":
-                    city = args.get("city_english")
-                    if not city: city = profile.get("location") or profile.get("city")
-                    if not city: city = "Kyiv"
-                    tool_result = check_weather(city)
-                elif func_name == "save_profile_info":
-                    tool_result = save_profile_info(chat_id, args.get("info_json", "{}"))
-                
                 messages.append({
-                    "role": "tool", "content": tool_result, "tool_call_id": tool_call.id
+                    "role": "tool", "content": results[tool_call.id], "tool_call_id": tool_call.id
                 })
 
-            final_res = client_llm.chat.completions.create(
-                model=AGENT_MODEL, 
-                messages=messages,
-                max_tokens=TOKEN_AI  # Ensure final response also respects the limit
-            )
-            ai_text = final_res.choices[0].message.content
-        else:
-            ai_text = msg.content
+            # Only the final answer is streamed; on_partial gets the chunks so far (joined
+            # only when shown) and must return quickly (it runs while LLM_SEM is held)
+            parts = []
+            async with LLM_SEM:
+                stream = await client_llm.chat.completions.create(
+                    model=AGENT_MODEL, 
+                    messages=messages,
+                    max_tokens=TOKEN_AI,  # Ensure final response also respects the limit
+                    stream=True
+                )
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if not delta: continue
+                    parts.append(delta)
+                    if on_partial: await on_partial(parts)
+            return "".join(parts), False
+        return msg.content, True
 
+    try:
+        ai_text = await llm_cache.get_or_compute(chat_id, messages, profile_version, ask_llm)
     except Exception as e:
         logger.error(f"LLM Error: {e}")
         ai_text = "Sorry, technical glitch."
 
-    clean_history.append({"role": "user", "content": user_text})
-    clean_history.append({"role": "assistant", "content": ai_text})
-    db.update_history(chat_id, clean_history)
+    if ai_text:
+        await db.append_history(chat_id, [
+            {"role": "user", "content": user_text},
+            {"role": "assistant", "content": ai_text}
+        ])
 
     return ai_text
 
@@ -448,19 +695,21 @@ async def strava_callback_handler(request):
         return web.Response(text="Error: Missing code or state.")
 
     try:
-        res = requests.post(
+        async with http_session.post(
             'https://www.strava.com/oauth/token',
             data={
                 'client_id': STRAVA_CLIENT_ID,
                 'client_secret': STRAVA_CLIENT_SECRET,
                 'code': code,
                 'grant_type': 'authorization_code'
-            }, timeout=10
-        )
-        data = res.json()
+            }
+        ) as res:
+            data = orjson.loads(await res.read())
         
         if 'access_token' in data:
-            db.save_strava_tokens(chat_id, data)
+            await db.save_strava_tokens(chat_id, data)
+            check_strava.invalidate(chat_id)
+            _token_cache.pop(chat_id, None)
             logger.info(f"✅ Strava connected for {chat_id}")
             await bot.send_message(chat_id=chat_id, text="✅ **Success!** Strava connected!", parse_mode="Markdown")
             return web.Response(text="Success! You can close this window.")
@@ -474,9 +723,16 @@ async def strava_callback_handler(request):
 
 async def telegram_webhook_handler(request):
     """Handles incoming Telegram Webhook updates."""
+    # Reject probes before reading/parsing the body
+    secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not hmac.compare_digest(secret.encode(), WEBHOOK_SECRET.encode()):
+        return web.Response(status=401)
+    if (request.content_length or 0) > WEBHOOK_MAX_BODY:
+        return web.Response(status=413)
+
     app = request.app['application']
     try:
-        json_data = await request.json()
+        json_data = orjson.loads(await request.read())
         update = Update.de_json(json_data, app.bot)
         await app.process_update(update)
         return web.Response(text="OK")
@@ -486,37 +742,141 @@ async def telegram_webhook_handler(request):
 
 async def on_startup(web_app):
     """Starts the bot on server startup."""
+    global http_session
+    http_session = aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=10),
+        connector=aiohttp.TCPConnector(limit=100, ttl_dns_cache=300, keepalive_timeout=60)
+    )
+    web_app['http'] = http_session
+    await db.connect()
+
     application = web_app['application']
     await application.initialize()
     await application.start()
-    
+
+async def set_webhook(bot):
+    """Registers the webhook with Telegram. Done once per deployment, not per worker."""
     webhook_url = f"{BASE_URL}/telegram"
     logger.info(f"🔗 Setting webhook to: {webhook_url}")
-    await application.bot.set_webhook(url=webhook_url)
+    await bot.set_webhook(url=webhook_url, secret_token=WEBHOOK_SECRET)
 
 async def on_shutdown(web_app):
     """Stops the bot on server shutdown."""
     application = web_app['application']
     await application.stop()
     await application.shutdown()
+    await db.close()
+    await web_app['http'].close()
+    WHISPER_EXECUTOR.shutdown(wait=False)
 
 # ============================================================================
 # 6. BOT HANDLERS & COMMANDS
 # ============================================================================
 
-async def connect_strava_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # Ignore technical updates
-    if not update.message: return
+class ReplyStreamer:
+    """Sends one reply and edits it progressively while the LLM answer streams in.
+
+    update() never waits on Telegram: at most one edit is in flight, so a slow
+    edit does not hold up the LLM stream (or its LLM_SEM slot). finish() makes
+    sure the final text is delivered, waiting out flood control if needed.
+    """
+    EDIT_INTERVAL = 1.0  # min seconds between edits (Telegram flood control)
+    FINISH_ATTEMPTS = 3
+
+    def __init__(self, message):
+        self.message = message
+        self.reply = None
+        self.shown = None
+        self.last_edit = 0.0
+        self.paused_until = 0.0
+        self.task = None
+
+    async def _send(self, text):
+        if self.reply is None:
+            self.reply = await self.message.reply_text(text)
+        else:
+            await self.reply.edit_text(text)
+        self.shown = text
 
-    chat_id = str(update.message.chat_id)
+    async def _show_partial(self, text):
+        try:
+            await self._send(text)
+        except RetryAfter as e:
+            self.paused_until = time.monotonic() + e.retry_after
+        except Exception as e:
+            logger.error(f"Stream Edit Error: {e}")
 
-    # --- ACCESS CHECK ---
-    profile = db.get_profile(chat_id)
-    if not profile.get("is_allowed"):
+    async def update(self, parts):
+        now = time.monotonic()
+        if (self.task and not self.task.done()) or now < self.paused_until:
+            return
+        if now - self.last_edit < self.EDIT_INTERVAL:
+            return
+        self.last_edit = now
+        self.task = asyncio.create_task(self._show_partial("".join(parts) + " ▌"))
+
+    async def finish(self, text):
+        if self.task:
+            await self.task
+        if text == self.shown: return
+        for _ in range(self.FINISH_ATTEMPTS):
+            try:
+                await self._send(text)
+                return
+            except RetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except BadRequest as e:
+                if self.reply is None: raise
+                # Edit refused: replace the partial message with a new one
+                logger.error(f"Stream Edit Error: {e}")
+                try:
+                    await self.reply.delete()
+                except Exception as e:
+                    logger.error(f"Stream Delete Error: {e}")
+                self.reply = None
+        await self._send(text)
+
+def requires_access(on_locked=None):
+    """Handler decorator: ignores technical updates, loads the user row once and
+    stashes it in context.chat_data['user_row'] for the handler (refreshed on every call).
+    Users without access get on_locked(update, context), or LOCKED_MESSAGE by default."""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            if not update.message: return
+
+            user_row = await db.get_user_row(str(update.message.chat_id))
+            if not user_row[0].get("is_allowed"):
+                if on_locked:
+                    return await on_locked(update, context)
+                return await update.message.reply_text(LOCKED_MESSAGE, parse_mode="HTML")
+
+            context.chat_data['user_row'] = user_row
+            return await handler(update, context)
+        return wrapper
+    return decorator
+
+async def check_invite_code(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Locked users unlock the bot by sending the invite code as a text message."""
+    chat_id = str(update.message.chat_id)
+    if (update.message.text or "").strip() == INVITE_CODE:
+        # PASSWORD CORRECT
+        await db.save_profile_data(chat_id, {"is_allowed": True})
+        await update.message.reply_text(
+            "🥊 <b>Access Granted!</b> Welcome to the club.\n\nI am your personal coach now. Start with /connect_strava or just tell me about your goals.",
+            parse_mode="HTML"
+        )
+    else:
+        # PASSWORD INCORRECT
         await update.message.reply_text(LOCKED_MESSAGE, parse_mode="HTML")
-        return
-    # --------------------
-    
+
+async def ask_text_password(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text("🔒 Please enter the text password first.")
+
+@requires_access()
+async def connect_strava_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = str(update.message.chat_id)
+
     if not STRAVA_CLIENT_ID or not REDIRECT_URI:
         await update.message.reply_text("❌ Configuration Error.")
         return
@@ -535,122 +895,79 @@ async def connect_strava_command(update: Update, context: ContextTypes.DEFAULT_T
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
 
+@requires_access()
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not update.message: return
-
-    chat_id = str(update.message.chat_id)
-    
-    # --- ACCESS CHECK ---
-    profile = db.get_profile(chat_id)
-    if not profile.get("is_allowed"):
-        await update.message.reply_text(LOCKED_MESSAGE, parse_mode="HTML")
-        return
-    # --------------------
-
     await update.message.reply_text("👋 Hi! I'm ActiveBuddy.\nPress /connect_strava to link your activities (Run, Ride, Swim, etc.).")
 
+@requires_access(on_locked=check_invite_code)
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # 1. Ignore technical updates (no text)
-    if not update.message or not update.message.text:
-        return
-
+    user_row = context.chat_data['user_row']
     chat_id = str(update.message.chat_id)
     user_text = update.message.text
-    
-    profile = db.get_profile(chat_id)
-    
-    # 2. CHECK ACCESS (INVITE CODE)
-    if not profile.get("is_allowed"):
-        # Check password
-        if user_text.strip() == INVITE_CODE:
-            # PASSWORD CORRECT
-            db.save_profile_data(chat_id, {"is_allowed": True})
-            await update.message.reply_text(
-                "🥊 <b>Access Granted!</b> Welcome to the club.\n\nI am your personal coach now. Start with /connect_strava or just tell me about your goals.",
-                parse_mode="HTML"
-            )
-            return
-        else:
-            # PASSWORD INCORRECT
-            await update.message.reply_text(LOCKED_MESSAGE, parse_mode="HTML")
-            return
 
-    # 3. ACCESS GRANTED - RUN LOGIC
     await update.message.chat.send_action("typing")
-    response = await asyncio.to_thread(run_agent_cycle, update.message.chat_id, user_text)
-    await update.message.reply_text(response)
+    streamer = ReplyStreamer(update.message)
+    response = await run_agent_cycle(chat_id, user_text, user_row, on_partial=streamer.update)
+    await streamer.finish(response)
 
+@requires_access(on_locked=ask_text_password)
 async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not update.message: return
-
+    user_row = context.chat_data['user_row']
     chat_id = str(update.message.chat_id)
 
-    # --- ACCESS CHECK ---
-    profile = db.get_profile(chat_id)
-    if not profile.get("is_allowed"):
-        await update.message.reply_text("🔒 Please enter the text password first.")
-        return
-    # --------------------
-
     status = await update.message.reply_text("👂 Listening...")
-    temp_file = f"voice_{update.message.voice.file_id}.ogg"
     try:
         new_file = await context.bot.get_file(update.message.voice.file_id)
-        await new_file.download_to_drive(temp_file)
+        # Voice notes are small; keep them in memory instead of a temp file
+        audio = bytes(await new_file.download_as_bytearray())
         def transcribe():
-            with open(temp_file, "rb") as f:
-                # removed language="uk" to allow auto-detection
-                return client_whisper.audio.transcriptions.create(model=WHISPER_MODEL, file=f).text
-        text = await asyncio.to_thread(transcribe)
+            # removed language="uk" to allow auto-detection
+            return client_whisper.audio.transcriptions.create(
+                model=WHISPER_MODEL, file=("voice.ogg", audio, "audio/ogg")
+            ).text
+        async with WHISPER_SEM:
+            text = await asyncio.get_running_loop().run_in_executor(WHISPER_EXECUTOR, transcribe)
         await status.edit_text(f"🗣 <i>\"{text}\"</i>", parse_mode="HTML")
         await update.message.chat.send_action("typing")
-        response = await asyncio.to_thread(run_agent_cycle, update.message.chat_id, text)
-        await update.message.reply_text(response)
+        streamer = ReplyStreamer(update.message)
+        response = await run_agent_cycle(chat_id, text, user_row, on_partial=streamer.update)
+        await streamer.finish(response)
     except Exception as e:
         logger.error(f"Voice Error: {e}")
         await status.edit_text("❌ Error.")
-    finally:
-        if os.path.exists(temp_file): os.remove(temp_file)
 
+@requires_access()
 async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not update.message: return
-    chat_id = str(update.message.chat_id)
-    
-    # --- ACCESS CHECK ---
-    profile = db.get_profile(chat_id)
-    if not profile.get("is_allowed"):
-        await update.message.reply_text(LOCKED_MESSAGE, parse_mode="HTML")
-        return
-    # --------------------
+    profile = context.chat_data['user_row'][0]
 
     if not profile:
         await update.message.reply_text("🤷‍♂️ Profile is empty.")
     else:
-        formatted_json = json.dumps(profile, indent=2, ensure_ascii=False)
+        formatted_json = orjson.dumps(profile, option=orjson.OPT_INDENT_2).decode()
         await update.message.reply_text(f"📂 **PROFILE:**\n<pre>{formatted_json}</pre>", parse_mode="HTML")
 
+@requires_access()
 async def show_last_strava(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not update.message: return
     chat_id = str(update.message.chat_id)
 
-    # --- ACCESS CHECK ---
-    profile = db.get_profile(chat_id)
-    if not profile.get("is_allowed"):
-        await update.message.reply_text(LOCKED_MESSAGE, parse_mode="HTML")
-        return
-    # --------------------
-
     await update.message.reply_text("🔄 Checking Strava...")
-    response_text = await asyncio.to_thread(check_strava, chat_id)
+    response_text = await check_strava(chat_id)
     await update.message.reply_text(response_text)
 
 # ============================================================================
 # MAIN
 # ============================================================================
-async def main():
-    logger.info("🚀 STARTING WEBHOOK MODE...")
-
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+async def app_factory():
+    """Builds the web app (one per process). Entry point for gunicorn workers."""
+    # PTB already pools 256 Bot API connections; only bound the waits
+    application = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .pool_timeout(10.0)
+        .connect_timeout(5.0)
+        .read_timeout(30.0)
+        .build()
+    )
     
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("profile", show_profile))
@@ -668,12 +985,19 @@ async def main():
 
     web_app.on_startup.append(on_startup)
     web_app.on_shutdown.append(on_shutdown)
+    return web_app
 
+async def main():
+    """Single-process mode: `python main.py` (see gunicorn.conf.py for multi-worker)."""
+    logger.info("🚀 STARTING WEBHOOK MODE...")
+
+    web_app = await app_factory()
     runner = web.AppRunner(web_app)
     await runner.setup()
     
     site = web.TCPSite(runner, '0.0.0.0', 8080)
     await site.start()
+    await set_webhook(web_app['bot'])
 
     logger.info(f"🌍 Webhook Server running on port 8080. Base URL: {BASE_URL}")
     
@@ -681,6 +1005,9 @@ async def main():
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        if uvloop:
+            uvloop.run(main())
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         pass